@@ -3,7 +3,8 @@ from ring_attention_pytorch.ring_attention import (
     RingTransformer,
     RingRotaryEmbedding,
     apply_rotary_pos_emb,
-    default_attention
+    default_attention,
+    quantize_linears_for_inference
 )
 
 from ring_attention_pytorch.ring_flash_attention import (
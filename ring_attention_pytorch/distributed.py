@@ -6,6 +6,8 @@ from torch.autograd import Function
 
 import torch.distributed as dist
 
+import einx
+
 def exists(val):
     return val is not None
 
@@ -66,8 +66,9 @@ def send_and_receive_(x, receive_buffer, send_to_rank, receive_from_rank):
     send_op = dist.P2POp(dist.isend, x, send_to_rank)
     recv_op = dist.P2POp(dist.irecv, receive_buffer, receive_from_rank)
 
-    reqs = dist.batch_isend_irecv([send_op, recv_op])
+    return dist.batch_isend_irecv([send_op, recv_op])
 
+def wait_(reqs):
     for req in reqs:
         req.wait()
 
@@ -87,7 +88,8 @@ def ring_pass(
     else:
         receive_buffer = receive_buffer.contiguous()
 
-    send_and_receive_(x, receive_buffer, circular_rank_right(ring_size = ring_size), circular_rank_left(ring_size = ring_size))
+    reqs = send_and_receive_(x, receive_buffer, circular_rank_right(ring_size = ring_size), circular_rank_left(ring_size = ring_size))
+    wait_(reqs)
     return receive_buffer, x
 
 one_ring_pass = partial(ring_pass, 1)
@@ -99,7 +101,7 @@ RingInfo = namedtuple('RingInfo', ['ring_rank', 'iter_info'])
 def null_ring_pass(*tensors, max_iters = None, receive_buffers = None, ring_size = None):
     yield RingInfo(0, (True, True)), (tensors, receive_buffers)
 
-def all_ring_pass(*tensors, max_iters = None, receive_buffers = None, ring_size = None):
+def all_ring_pass(*tensors, max_iters = None, receive_buffers = None, ring_size = None, prefetch = False):
     ring_size = default(ring_size, get_world_size())
     max_iters = default(max_iters, ring_size)
 
@@ -111,10 +113,38 @@ def all_ring_pass(*tensors, max_iters = None, receive_buffers = None, ring_size
 
     curr_ring_pos = get_rank()
 
+    def start_ring_pass(tensors, receive_buffers):
+        reqs = []
+        new_tensors = []
+        new_receive_buffers = []
+
+        for tensor, receive_buffer in zip(tensors, receive_buffers):
+            if not exists(tensor):
+                new_tensors.append(None)
+                new_receive_buffers.append(None)
+                continue
+
+            tensor = tensor.contiguous()
+            receive_buffer = torch.zeros_like(tensor) if not exists(receive_buffer) else receive_buffer.contiguous()
+
+            reqs.extend(send_and_receive_(tensor, receive_buffer, circular_rank_right(ring_size = ring_size), circular_rank_left(ring_size = ring_size)))
+
+            new_tensors.append(receive_buffer)
+            new_receive_buffers.append(tensor)
+
+        return reqs, new_tensors, new_receive_buffers
+
     for ind in range(total_iters):
         is_first = ind == 0
         is_last = ind == (total_iters - 1)
 
+        # with prefetch, post the next ring pass up front so the transfer overlaps the
+        # local tile compute. only safe when the consumer treats the yielded tensors as
+        # read-only - the backward mutates its traveling dk / dv, so it must not prefetch
+
+        if prefetch and not is_last:
+            reqs, new_tensors, new_receive_buffers = start_ring_pass(tensors, receive_buffers)
+
         yield RingInfo(curr_ring_pos, (is_first,  is_last)), (tensors, receive_buffers)
 
         curr_ring_pos = circular_index_left(curr_ring_pos, ring_size)
@@ -122,17 +152,10 @@ def all_ring_pass(*tensors, max_iters = None, receive_buffers = None, ring_size
         if is_last:
             continue
 
-        new_tensors = []
-        new_receive_buffers = []
-
-        for tensor, receive_buffer in zip(tensors, receive_buffers):
-            if exists(tensor):
-                new_tensor, new_receive_buffer = one_ring_pass(tensor, receive_buffer, ring_size)
-            else:
-                new_tensor, new_receive_buffer = None, None
+        if not prefetch:
+            reqs, new_tensors, new_receive_buffers = start_ring_pass(tensors, receive_buffers)
 
-            new_tensors.append(new_tensor)
-            new_receive_buffers.append(new_receive_buffer)
+        wait_(reqs)
 
         tensors = new_tensors
         receive_buffers = new_receive_buffers
@@ -1,12 +1,11 @@
 from typing import Optional, Tuple, Union
 
 import torch
-from torch import nn, einsum, Tensor
+from torch import nn, Tensor
 import torch.nn.functional as F
 from torch.cuda.amp import autocast
 from torch.nn import Module, ModuleList
 
-import einx
 from einx import rearrange
 
 from beartype import beartype
@@ -23,7 +22,6 @@ from ring_attention_pytorch.ring_flash_attention import (
 )
 
 from ring_attention_pytorch.distributed import (
-    split_by_rank,
     AllGather
 )
 
@@ -48,34 +46,46 @@ def default_attention(
     mask: Optional[Tensor] = None,
     causal: bool = False
 ):
-    device = q.device
-    q = q * (q.shape[-1] ** -0.5)
+    # sdpa dispatches to flash / memory-efficient kernels with online softmax,
+    # so even this non-ring fallback stays O(n) in activation memory
 
-    mask_value = -torch.finfo(q.dtype).max
+    q, k, v = map(lambda t: t.transpose(1, 2), (q, k, v))
 
-    # similarity
+    i, j = q.shape[-2], k.shape[-2]
 
-    sim = einsum('b i h d, b j h d -> b h i j', q, k)
+    attn_mask = None
+    use_is_causal = causal and i == j
 
-    # masking
+    if causal and i != j:
+        # sdpa's is_causal is top-left aligned - for cross attention, pass an explicit
+        # bottom-right aligned mask to match the flash path's qk_len_diff tile masks
 
-    if causal:
-        i, j = sim.shape[-2:]
-        causal_mask = torch.ones((i, j), dtype = torch.bool, device = device).triu(j - i + 1)
-        sim = torch.where(causal_mask, mask_value, sim)
+        attn_mask = torch.ones((i, j), dtype = torch.bool, device = q.device).tril(j - i)
 
-    elif exists(mask):
-        sim = einx.where('b j, b h i j, -> b h i j', mask, sim, mask_value)
+    elif not causal and exists(mask):
+        # a free view over the mask shared by all layers, nothing materialized per layer
 
-    # attend
+        attn_mask = mask[:, None, None, :]
 
-    attn = einx.softmax('b h i [j]', sim)
+    out = F.scaled_dot_product_attention(
+        q, k, v,
+        attn_mask = attn_mask,
+        is_causal = use_is_causal
+    )
+
+    return out.transpose(1, 2)
 
-    # aggregate
+# int8 inference
+# dynamically quantizes all linear projections (to_qkv, to_out, feedforwards) with per-channel weight scales
 
-    out = einsum('b h i j, b j h d -> b i h d', attn, v)
+def quantize_linears_for_inference(module: Module):
+    from torch.ao.quantization import quantize_dynamic, per_channel_dynamic_qconfig
 
-    return out
+    return quantize_dynamic(
+        module,
+        qconfig_spec = {nn.Linear: per_channel_dynamic_qconfig},
+        dtype = torch.qint8
+    )
 
 # rotary embeddings with modifications to support striped attention
 
@@ -158,14 +168,21 @@ def pad_to_multiple(
         return x, 0
 
     pad_length = length - remainder
-    return F.pad(x, (0, pad_length), value = pad_value), pad_length
+
+    # allocate uninitialized and fill only the tail, rather than F.pad zero-filling the whole output
+
+    padded = torch.empty((*x.shape[:-1], seq_len + pad_length), dtype = x.dtype, device = x.device)
+    padded[..., :seq_len] = x
+    padded[..., seq_len:] = pad_value
+
+    return padded, pad_length
 
 def maybe_pad_seq_and_mask(
     x: Tensor,
     mask: Optional[Tensor],
     seq_size: int
 ):
-    orig_x, seq_len = x, x.shape[-1]
+    seq_len = x.shape[-1]
 
     # auto pad sequence and mask, as ring passing makes assumption tensor is all same shape
 
@@ -175,7 +192,11 @@ def maybe_pad_seq_and_mask(
         return x, mask
 
     if not exists(mask):
-        mask = torch.ones_like(orig_x).bool()
+        # build the padded mask directly, rather than allocating a full ones_like and padding it
+
+        mask = torch.arange(x.shape[-1], device = x.device) < seq_len
+        mask = mask[None, :].expand(x.shape[0], -1)
+        return x, mask
 
     mask, _ = pad_to_multiple(mask, seq_size, pad_value = False)
 
@@ -189,13 +210,20 @@ def sharded_batch_to_sharded_seq(
     assert is_distributed()
 
     # all gather across batch
+    # if the mask has the same shape as the sequence, pack both into one collective
 
     all_gather = AllGather(dim = 0)
 
-    x, sizes = all_gather(x)
+    if exists(mask) and mask.shape == x.shape:
+        packed = torch.stack((x, mask.type_as(x)), dim = -1)
+        packed, sizes = all_gather(packed)
+        x, mask = packed.unbind(dim = -1)
+        mask = mask.bool()
+    else:
+        x, sizes = all_gather(x)
 
-    if exists(mask):
-        mask, _ = all_gather(mask)
+        if exists(mask):
+            mask, _ = all_gather(mask)
 
     # first make sure world size is divisible by the sequence size
 
@@ -209,16 +237,15 @@ def sharded_batch_to_sharded_seq(
 
     x = rearrange('(b s) n -> b (s n)', x, s = num_sharded_batches)
 
-    # then split sequence across machines
+    # then split sequence across machines, each rank narrowing out its own chunk
 
-    x = x.split(seq_size, dim = -1)
+    rank = get_rank()
 
-    x, _ = split_by_rank(x)
+    x = x.narrow(-1, rank * seq_size, seq_size)
 
     if exists(mask):
         mask = rearrange('(b s) n -> b (s n)', mask, s = num_sharded_batches)
-        mask = mask.split(seq_size, dim = -1)
-        mask, _ = split_by_rank(mask)
+        mask = mask.narrow(-1, rank * seq_size, seq_size)
 
     return (x, mask), sizes, num_sharded_batches
 
@@ -233,11 +260,13 @@ def sharded_seq_to_sharded_batch(
 
     logits = rearrange('b (s n) c -> (b s) n c', logits, s = num_sharded_batches)
 
-    logits = logits.split(sizes.tolist(), dim = 0)
+    # narrow out this rank's batch rows directly, rather than splitting into a python tuple of views
+    # a single transfer of the sizes to host, reused for both the offset and the length
 
-    logits, _ = split_by_rank(logits)
+    rank = get_rank()
+    sizes = sizes.tolist()
 
-    return logits
+    return logits.narrow(0, sum(sizes[:rank]), sizes[rank])
 
 # main class
 
@@ -332,8 +361,8 @@ class RingAttention(Module):
         """
 
         ring_size = default(ring_size, get_world_size())
-        ring_attn = self.ring_attn & is_distributed()
-        auto_shard_seq = self.auto_shard_seq & is_distributed()
+        ring_attn = self.ring_attn and is_distributed()
+        auto_shard_seq = self.auto_shard_seq and is_distributed()
 
         using_striped_ring_cuda = x.is_cuda and self.using_striped_ring_cuda
         striped_bucket_size = self.bucket_size if not using_striped_ring_cuda else self.ring_seq_size
@@ -354,7 +383,8 @@ class RingAttention(Module):
         device = x.device
 
         qkv = self.to_qkv(x)
-        q, k, v = rearrange('b n (qkv h d) -> qkv b n h d', qkv, qkv = 3, h = self.heads)
+        qkv = qkv.reshape(*qkv.shape[:2], 3, self.heads, -1).permute(2, 0, 1, 3, 4)
+        q, k, v = qkv.unbind(0)
 
         # rotary relative positions
 
@@ -400,7 +430,7 @@ class RingAttention(Module):
 
         # combine heads
 
-        out = rearrange('b n h d -> b n (h d)', out)
+        out = out.flatten(2)
         out = self.to_out(out)
 
         if auto_shard_seq:
@@ -409,20 +439,22 @@ class RingAttention(Module):
             if self.striped_ring_attn:
                 out = rearrange('b (j i) d -> b (i j) d', out, i = striped_bucket_size)
 
-            out = out[:, :seq_len]
+            if out.shape[1] != seq_len:
+                out = out[:, :seq_len]
 
         return out
 
 # simple transformer for end2end testing
 
 class RMSNorm(Module):
-    def __init__(self, dim):
+    def __init__(self, dim, eps = 1e-6):
         super().__init__()
-        self.scale = dim ** 0.5
+        self.eps = eps
         self.gamma = nn.Parameter(torch.ones(dim))
 
     def forward(self, x):
-        return F.normalize(x, dim = -1) * self.scale * self.gamma
+        inv_rms = torch.rsqrt(x.float().pow(2).mean(dim = -1, keepdim = True) + self.eps)
+        return (x * inv_rms).type_as(x) * self.gamma
 
 def FeedForward(dim, mult = 4):
     dim_inner = int(dim * mult)
@@ -453,7 +485,8 @@ class RingTransformer(Module):
         max_lookback_seq_len: Optional[Union[Tuple[int, ...], int]] = None,
         rotary_embed_theta: int = 10000,    # will need to be changed for the million token context
         ignore_index: int = -1,
-        use_cuda_kernel: Optional[bool] = None
+        use_cuda_kernel: Optional[bool] = None,
+        use_torch_compile: bool = False
     ):
         super().__init__()
 
@@ -519,6 +552,12 @@ class RingTransformer(Module):
 
         self.ignore_index = ignore_index
 
+        # optionally compile the forward with inductor for kernel fusion
+        # compiling the bound method keeps the state dict keys unchanged
+
+        if use_torch_compile:
+            self.forward = torch.compile(self.forward, mode = 'max-autotune')
+
     def forward(
         self,
         x,
@@ -600,6 +639,17 @@ class RingTransformer(Module):
 
             x = ff(x) + x
 
+        # unpad each rank's shard before the logits projection, so the projection does not
+        # spend compute on pad tokens. in the non-striped, non-interleaved layout all global
+        # padding sits at the tail of the last rank's shard, and the variable size all gather
+        # reassembles the already-unpadded sequence
+
+        if auto_shard_seq and not return_loss and not self.striped_ring_attn and num_sharded_batches == 1:
+            valid_len = min(max(seq_len - get_rank() * self.ring_seq_size, 0), x.shape[1])
+
+            if valid_len != x.shape[1]:
+                x = x[:, :valid_len]
+
         logits = self.to_logits(x)
 
         # handle returning of loss
@@ -625,4 +675,7 @@ class RingTransformer(Module):
         if self.striped_ring_attn:
             logits = rearrange('b (j i) d -> b (i j) d', logits, i = striped_bucket_size)
 
-        return logits[:, :seq_len]
+        if logits.shape[1] != seq_len:
+            logits = logits[:, :seq_len]
+
+        return logits
@@ -1,12 +1,11 @@
 import math
-from functools import partial
+from functools import lru_cache, partial
 from typing import Optional
 
 import torch
 from torch import nn, einsum, Tensor
 from torch.autograd.function import Function
 
-import einx
 from einx import rearrange
 
 from ring_attention_pytorch.ring import (
@@ -45,6 +44,10 @@ def maybe_split(t, size, dim = -2):
 
     return t.split(size, dim = dim)
 
+@lru_cache(maxsize = None)
+def create_causal_mask(i, j, diagonal, device):
+    return torch.ones((i, j), dtype = torch.bool, device = device).triu(diagonal)
+
 # ring + (flash) attention forwards and backwards
 
 # flash attention v1 - https://arxiv.org/abs/2205.14135
@@ -102,11 +105,15 @@ class RingFlashAttentionFunction(Function):
 
         row_ring_rank = (get_rank() % ring_size) if ring_reduce_col else 0
 
-        ring_pass_fn = all_ring_pass if ring_reduce_col else null_ring_pass
+        # the forward only reads the traveling kv, so the next hop can be prefetched
+
+        ring_pass_fn = partial(all_ring_pass, prefetch = True) if ring_reduce_col else null_ring_pass
 
         max_neg_value = -torch.finfo(q.dtype).max
 
-        o = torch.zeros_like(q)
+        # accumulate output and softmax statistics in fp32, regardless of input dtype
+
+        o = torch.zeros_like(q, dtype = torch.float32)
         batch, seq, heads, _ = q.shape
 
         all_row_sums = torch.zeros((batch, heads, seq, 1), device = device)
@@ -114,6 +121,10 @@ class RingFlashAttentionFunction(Function):
 
         scale = (q.shape[-1] ** -0.5)
 
+        # scale queries once up front, rather than every (i, j) logit tile
+
+        scaled_q = q * scale
+
         kv = torch.stack((k, v))
 
         # receive buffers, to be alternated with sent buffer
@@ -125,18 +136,29 @@ class RingFlashAttentionFunction(Function):
 
             k, v = kv
 
+            # precompute the additive bias and multiplicative keep mask once per ring pass,
+            # rather than broadcasting the bool mask in every tile
+
+            mask_bias = mask_keep = None
+
+            if exists(mask):
+                expanded_mask = rearrange('b j -> b 1 1 j', mask)
+                mask_bias = torch.where(expanded_mask, 0., max_neg_value).type_as(q)
+                mask_keep = expanded_mask.float()
+
             col_splits = zip(
                 k.split(bucket_size, dim = -3),
                 v.split(bucket_size, dim = -3),
-                maybe_split(mask, bucket_size, dim = -1)
+                maybe_split(mask_bias, bucket_size, dim = -1),
+                maybe_split(mask_keep, bucket_size, dim = -1)
             )
 
-            for k_ind, (kc, vc, col_mask) in enumerate(col_splits):
+            for k_ind, (kc, vc, col_bias, col_keep) in enumerate(col_splits):
                 col_ring_rank = ring_rank % ring_size
                 col_bucket_index = col_ring_rank * per_machine_buckets + k_ind
 
                 row_splits = zip(
-                    q.split(bucket_size, dim = -3),
+                    scaled_q.split(bucket_size, dim = -3),
                     o.split(bucket_size, dim = -3),
                     all_row_sums.split(bucket_size, dim = -2),
                     all_row_maxes.split(bucket_size, dim = -2),
@@ -146,10 +168,10 @@ class RingFlashAttentionFunction(Function):
 
                     row_bucket_index = row_ring_rank * per_machine_buckets + ind
 
-                    attn_weights = einsum('b i h d, b j h d -> b h i j', qc, kc) * scale
+                    attn_weights = torch.matmul(qc.transpose(1, 2), kc.permute(0, 2, 3, 1))
 
-                    if exists(col_mask):
-                        attn_weights = einx.where('b j, b h i j, -> b h i j', col_mask, attn_weights, max_neg_value)
+                    if exists(col_bias):
+                        attn_weights = attn_weights + col_bias
 
                     if causal:
                         qk_len_diff = kc.shape[-3] - qc.shape[-3]
@@ -161,27 +183,29 @@ class RingFlashAttentionFunction(Function):
                             # `GetMaskStripedAttention` pseudocode at end of section 2.2.1 of https://arxiv.org/abs/2311.09431
 
                             triu_offset = int(row_bucket_index >= col_bucket_index)
-                            causal_mask = torch.ones((qc.shape[-3], kc.shape[-3]), dtype = torch.bool, device = device).triu(triu_offset + qk_len_diff)
+                            causal_mask = create_causal_mask(qc.shape[-3], kc.shape[-3], triu_offset + qk_len_diff, device)
                             attn_weights.masked_fill_(causal_mask, max_neg_value)
 
                         else:
                             if row_bucket_index == col_bucket_index:
-                                causal_mask = torch.ones((qc.shape[-3], kc.shape[-3]), dtype = torch.bool, device = device).triu(1 + qk_len_diff)
+                                causal_mask = create_causal_mask(qc.shape[-3], kc.shape[-3], 1 + qk_len_diff, device)
                                 attn_weights.masked_fill_(causal_mask, max_neg_value)
                             elif row_bucket_index < col_bucket_index:
                                 attn_weights.fill_(max_neg_value)
 
+                    attn_weights = attn_weights.float()
+
                     block_row_maxes = attn_weights.amax(dim = -1, keepdims = True)
                     new_row_maxes = torch.maximum(block_row_maxes, row_maxes)
 
                     exp_weights = torch.exp(attn_weights - new_row_maxes)
 
-                    if exists(col_mask):
-                        exp_weights = einx.where('b j, b h i j, -> b h i j', col_mask, exp_weights, 0.)
+                    if exists(col_keep):
+                        exp_weights = exp_weights * col_keep
 
                     block_row_sums = exp_weights.sum(dim = -1, keepdims = True).clamp(min = EPSILON)
 
-                    exp_values = einsum('b h i j, b j h d -> b i h d', exp_weights, vc)
+                    exp_values = torch.matmul(exp_weights.type_as(vc), vc.transpose(1, 2)).transpose(1, 2)
 
                     exp_row_max_diff = torch.exp(row_maxes - new_row_maxes)
 
@@ -194,6 +218,7 @@ class RingFlashAttentionFunction(Function):
                     row_sums.copy_(new_row_sums)
 
         o.div_(rearrange('b h n 1 -> b n h 1', all_row_sums))
+        o = o.type_as(q)
 
         lse = all_row_sums.clamp(min = EPSILON).log() + all_row_maxes
 
@@ -261,12 +286,19 @@ class RingFlashAttentionFunction(Function):
 
             k, v, dk, dv = kv_and_dkv
 
+            # as in the forward, broadcast the bool mask once per ring pass
+
+            expanded_mask = None
+
+            if exists(mask):
+                expanded_mask = rearrange('b j -> b 1 1 j', mask)
+
             col_splits = zip(
                 k.split(bucket_size, dim = 1),
                 v.split(bucket_size, dim = 1),
                 dk.split(bucket_size, dim = 1),
                 dv.split(bucket_size, dim = 1),
-                maybe_split(mask, bucket_size, dim = -1)
+                maybe_split(expanded_mask, bucket_size, dim = -1)
             )
 
             for k_ind, (kc, vc, dkc, dvc, col_mask) in enumerate(col_splits):
@@ -293,11 +325,11 @@ class RingFlashAttentionFunction(Function):
                             # `GetMaskStripedAttention` pseudocode at end of section 2.2.1 of https://arxiv.org/abs/2311.09431
 
                             triu_offset = int(row_bucket_index >= col_bucket_index)
-                            causal_mask = torch.ones((qc.shape[1], kc.shape[1]), dtype = torch.bool, device = device).triu(triu_offset)
+                            causal_mask = create_causal_mask(qc.shape[1], kc.shape[1], triu_offset, device)
                             attn_weights.masked_fill_(causal_mask, max_neg_value)
                         else:
                             if row_bucket_index == col_bucket_index:
-                                causal_mask = torch.ones((qc.shape[1], kc.shape[1]), dtype = torch.bool, device = device).triu(1)
+                                causal_mask = create_causal_mask(qc.shape[1], kc.shape[1], 1, device)
                                 attn_weights.masked_fill_(causal_mask, max_neg_value)
                             elif row_bucket_index < col_bucket_index:
                                 attn_weights.fill_(max_neg_value)
@@ -305,7 +337,14 @@ class RingFlashAttentionFunction(Function):
                     p = torch.exp(attn_weights - lsec)
 
                     if exists(col_mask):
-                        p = einx.where('b j, b h i j, -> b h i j', col_mask, p, 0.)
+                        # must select, not multiply - p overflows to inf on fully masked
+                        # rows, where the saturated lse no longer bounds the logits
+
+                        p = torch.where(col_mask, p, 0.)
+
+                    # the fp32 lse promoted p - cast back to the input dtype for the grad GEMMs
+
+                    p = p.type_as(doc)
 
                     dv_chunk = einsum('b h i j, b i h d -> b j h d', p, doc)
                     dp = einsum('b i h d, b j h d -> b h i j', doc, vc)